@@ -4,37 +4,45 @@ Multimodal RAG System - Main Application
 This script orchestrates the complete workflow:
 1. Extract elements from PDF (text, tables, images)
 2. Generate summaries using Llama-8B and Gemini (with caching)
-3. Store in ChromaDB with embeddings
+3. Store in a FAISS index with embeddings
 4. Create RAG pipeline for querying
 """
 
 import os
 import sys
-import json
 import hashlib
+import orjson
 from pathlib import Path
 
+try:
+    from blake3 import blake3 as file_hasher
+except ImportError:
+    file_hasher = hashlib.blake2b
+
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from src.extract_elements import extract_elements
 from src.generate_summaries import generate_summaries
+from src.summary_cache import clear_summaries
 from src.vector_store import VectorStore
 from src.rag_pipeline import RAGPipeline, format_response
 
 
 def get_pdf_hash(pdf_path: str) -> str:
-    """Get hash of PDF file to detect changes."""
+    """Get hash of PDF file to detect changes, streamed in 1 MiB chunks."""
+    hasher = file_hasher()
     with open(pdf_path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
 
 
 def load_cached_summaries(cache_dir: str = "data/cache") -> dict:
     """Load cached summaries if they exist."""
     cache_path = Path(cache_dir) / "summaries_cache.json"
     if cache_path.exists():
-        with open(cache_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return orjson.loads(cache_path.read_bytes())
     return None
 
 
@@ -48,8 +56,7 @@ def save_cached_summaries(summaries: dict, pdf_hash: str, cache_dir: str = "data
         "summaries": summaries
     }
     
-    with open(cache_path / "summaries_cache.json", 'w', encoding='utf-8') as f:
-        json.dump(cache_data, f, indent=2)
+    (cache_path / "summaries_cache.json").write_bytes(orjson.dumps(cache_data))
     
     print("  💾 Cached summaries for future runs\n")
 
@@ -95,14 +102,10 @@ def main():
     print("-" * 80)
     vector_store = VectorStore()
     
-    # Check if vector store already has data
+    # Idempotent: only summaries not already in the index are embedded and added;
+    # the PDF is the whole corpus, so entries no longer in it are pruned
+    vector_store.add_summaries(summarized_elements, prune=True)
     stats = vector_store.get_collection_stats()
-    if stats.get("total_documents", 0) > 0 and use_cache:
-        print(f"  ℹ️  Vector store already populated with {stats['total_documents']} documents")
-        print("  ⏭️  Skipping re-indexing\n")
-    else:
-        vector_store.add_summaries(summarized_elements)
-        stats = vector_store.get_collection_stats()
     
     print(f"📊 Vector Store Stats: {stats}")
     
@@ -146,9 +149,14 @@ def main():
             
             if question.lower() == 'clear':
                 cache_path = Path("data/cache/summaries_cache.json")
-                if cache_path.exists():
+                cleared_pdf_cache = cache_path.exists()
+                if cleared_pdf_cache:
                     cache_path.unlink()
-                    print("🗑️  Cache cleared! Restart to re-process PDF.\n")
+                cleared_summaries = clear_summaries()
+                
+                if cleared_pdf_cache or cleared_summaries:
+                    print(f"🗑️  Cache cleared ({cleared_summaries} per-element summaries removed)! "
+                          "Restart to re-process PDF and regenerate all summaries.\n")
                 else:
                     print("ℹ️  No cache to clear.\n")
                 continue
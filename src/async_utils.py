@@ -0,0 +1,50 @@
+"""
+Async Utilities Module
+Event loop runner and shared HTTP connection pool for the async API clients.
+"""
+
+import asyncio
+from typing import Awaitable, TypeVar
+import httpx
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
+T = TypeVar("T")
+
+
+def run_async(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion, on uvloop when it is installed.
+    
+    Args:
+        coro: Coroutine to run
+        
+    Returns:
+        The coroutine's result
+    """
+    if uvloop is not None:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
+
+
+def shared_http_client(max_connections: int = 32) -> httpx.AsyncClient:
+    """
+    Create an HTTP/2 client whose connection pool is shared by all requests of a run.
+    
+    Concurrent requests are multiplexed over a few kept-alive connections instead
+    of each paying its own TLS handshake. The pool is bound to the running event
+    loop, so create one per run (use it as an async context manager).
+    
+    Args:
+        max_connections: Maximum number of open connections
+        
+    Returns:
+        httpx.AsyncClient to pass as `http_client` to AsyncGroq
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    )
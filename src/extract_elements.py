@@ -4,56 +4,396 @@ Extracts text, tables, and images from PDF documents using PyMuPDF.
 """
 
 
+import os
+import re
 import fitz  # PyMuPDF
-from typing import Dict, List
+import tiktoken
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
-from PIL import Image
-import io
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_images_with_pymupdf(pdf_path: str, output_dir: str = "data/extracted_images") -> List[Dict]:
+# Longest side, render resolution, and JPEG quality for figures sent to the vision model
+MAX_IMAGE_SIDE = 1024
+RENDER_DPI = 150
+JPEG_QUALITY = 85
+
+# Figures smaller than this (in rendered pixels, either side) are skipped
+MIN_IMAGE_PIXELS = 50
+
+# Figure parts closer than this (in points) are merged into one figure
+FIGURE_GAP = 5
+
+# Figure regions with more than this fraction inside a detected table are skipped
+TABLE_COVERAGE = 0.5
+
+# TextPage flags: join hyphenated line breaks, and keep image blocks (block type 1) for figure bboxes
+TEXTPAGE_FLAGS = (fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE
+                  | fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_PRESERVE_IMAGES)
+
+# Minimum pages per extraction worker process; shorter documents are processed in-process
+MIN_PAGES_PER_WORKER = 20
+
+# Token budget and overlap for merged text chunks
+CHUNK_TOKENS = 1000
+CHUNK_OVERLAP = 128
+
+
+@lru_cache(maxsize=None)
+def _get_encoding() -> tiktoken.Encoding:
+    """Load the tokenizer on first use (tiktoken downloads the BPE file the first time)."""
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def _merge_rects(rects: List) -> List:
     """
-    Extract images from PDF using PyMuPDF.
+    Merge rectangles that overlap or lie within FIGURE_GAP points of each other,
+    so the parts of one figure collapse into a single region.
     """
-    images_dir = Path(output_dir)
-    images_dir.mkdir(parents=True, exist_ok=True)
+    merged = [fitz.Rect(rect) for rect in rects]
+    
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            grown = fitz.Rect(merged[i]) + (-FIGURE_GAP, -FIGURE_GAP, FIGURE_GAP, FIGURE_GAP)
+            for j in range(i + 1, len(merged)):
+                if grown.intersects(merged[j]):
+                    merged[i] |= merged.pop(j)
+                    changed = True
+                    break
+            if changed:
+                break
     
+    # Reading order: top to bottom, then left to right
+    return sorted(merged, key=lambda rect: (rect.y0, rect.x0))
+
+
+def _covered_by_table(rect, table_rects: List) -> bool:
+    """Whether more than TABLE_COVERAGE of a figure region lies inside a detected table."""
+    area = rect.get_area()
+    return any((rect & table_rect).get_area() > TABLE_COVERAGE * area for table_rect in table_rects)
+
+
+def _extract_page_images(page, page_num: int, blocks: List[Tuple], table_rects: List, images_dir: Path) -> List[Dict]:
+    """
+    Render the figure regions of a single page.
+    
+    Embedded rasters (image blocks) and clusters of vector drawings that touch
+    are merged into one region per figure, and each region is rendered straight
+    to a JPEG pixmap rather than decoding and re-encoding the embedded rasters.
+    Regions mostly covered by a detected table (ruled tables are vector
+    drawings too) are left to the table pass.
+    """
     image_elements = []
-    pdf_document = fitz.open(pdf_path)
     
-    print(f"  🖼️  Extracting images with PyMuPDF...")
+    figure_rects = [fitz.Rect(block[:4]) for block in blocks if block[6] == 1]
+    figure_rects.extend(page.cluster_drawings())
+    figure_rects = [rect & page.rect for rect in _merge_rects(figure_rects)]
     
-    image_count = 0
-    for page_num in range(len(pdf_document)):
-        page = pdf_document[page_num]
-        image_list = page.get_images(full=True)
-        
-        for img_index, img in enumerate(image_list):
-            try:
-                xref = img[0]
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                # Skip very small images
-                if image.size[0] < 50 or image.size[1] < 50:
-                    continue
-                
-                image_filename = f"image_p{page_num+1}_{img_index}.png"
-                image_path = images_dir / image_filename
-                image.save(image_path)
-                
-                image_elements.append({
-                    "path": str(image_path),
-                    "page": page_num + 1,
-                    "element_id": f"image_{image_count}",
-                    "size": image.size
+    for img_index, rect in enumerate(figure_rects):
+        try:
+            if rect.is_empty or _covered_by_table(rect, table_rects):
+                continue
+            
+            # Render at up to RENDER_DPI, capped so the longest side fits MAX_IMAGE_SIDE
+            dpi = min(RENDER_DPI, int(72 * MAX_IMAGE_SIDE / max(rect.width, rect.height)))
+            
+            # Skip very small images (measured in rendered pixels)
+            if rect.width * dpi / 72 < MIN_IMAGE_PIXELS or rect.height * dpi / 72 < MIN_IMAGE_PIXELS:
+                continue
+            
+            pix = page.get_pixmap(clip=rect, dpi=dpi, alpha=False)
+            
+            image_filename = f"image_p{page_num+1}_{img_index}.jpg"
+            image_path = images_dir / image_filename
+            pix.save(image_path, jpg_quality=JPEG_QUALITY)
+            
+            image_elements.append({
+                "path": str(image_path),
+                "page": page_num + 1,
+                "size": (pix.width, pix.height)
+            })
+        except Exception as e:
+            print(f"    ⚠️  Failed to extract image on page {page_num+1}: {e}")
+    
+    return image_elements
+
+
+def _extract_page_tables(tabs, page_num: int) -> List[Dict]:
+    """
+    Convert the tables detected on a single page.
+    """
+    table_elements = []
+    
+    for tab in tabs:
+        try:
+            # Extract table as pandas dataframe then convert to text
+            df = tab.to_pandas()
+            table_text = df.to_string(index=False)
+            
+            if table_text and len(table_text) > 20:
+                table_elements.append({
+                    "text": table_text,
+                    "html": df.to_html(index=False),
+                    "page": page_num + 1
                 })
-                image_count += 1
-            except Exception as e:
-                print(f"    ⚠️  Failed to extract image on page {page_num+1}: {e}")
+        except Exception as e:
+            print(f"    ⚠️  Error processing table on page {page_num+1}: {e}")
+    
+    return table_elements
+
+
+def _chunk_blocks(texts: List[str]) -> List[str]:
+    """
+    Greedily merge consecutive text blocks into chunks of at most CHUNK_TOKENS
+    tokens, starting each new chunk with the last CHUNK_OVERLAP tokens of the
+    previous one. A single block over the budget is split into overlapping windows.
+    """
+    chunks = []
+    current: List[int] = []
+    fresh = 0  # tokens in `current` not yet emitted in an earlier chunk
+    encoding = _get_encoding()
+    
+    for text in texts:
+        tokens = encoding.encode(text + "\n")
+        
+        if fresh and len(current) + len(tokens) > CHUNK_TOKENS:
+            chunks.append(current)
+            current, fresh = current[-CHUNK_OVERLAP:], 0
+        
+        current = current + tokens
+        fresh += len(tokens)
+        
+        while len(current) > CHUNK_TOKENS:
+            chunks.append(current[:CHUNK_TOKENS])
+            current = current[CHUNK_TOKENS - CHUNK_OVERLAP:]
+            fresh = max(len(current) - CHUNK_OVERLAP, 0)
+    
+    if fresh:
+        chunks.append(current)
+    
+    return [encoding.decode(chunk).strip() for chunk in chunks]
+
+
+def _extract_page_text(blocks: List[Tuple], page_width: float) -> List[str]:
+    """
+    Collect the meaningful text blocks of a single page, in reading order.
+    
+    Blocks that span the column gutter (titles, abstracts, wide captions)
+    split the page into bands; within each band the left column is read before
+    the right one, each top to bottom. Columns are decided by the block midpoint.
+    """
+    text_blocks = []
+    
+    for block in blocks:
+        if block[6] == 0:
+            text = block[4].strip()
+            
+            # Only keep meaningful text blocks
+            if text and len(text) > 20:
+                text_blocks.append(block)
+    
+    gutter = page_width / 2
+    ordered, left, right = [], [], []
+    
+    def flush_band():
+        ordered.extend(sorted(left, key=lambda b: (b[1], b[0])))
+        ordered.extend(sorted(right, key=lambda b: (b[1], b[0])))
+        left.clear()
+        right.clear()
+    
+    for block in sorted(text_blocks, key=lambda b: (b[1], b[0])):
+        if block[0] < gutter < block[2]:
+            # Full-width block: finish the columns above it first
+            flush_band()
+            ordered.append(block)
+        elif (block[0] + block[2]) / 2 < gutter:
+            left.append(block)
+        else:
+            right.append(block)
+    flush_band()
+    
+    return [block[4].strip() for block in ordered]
+
+
+def _normalize_block(text: str) -> str:
+    """Normalize block text for exact-repeat detection (case and whitespace)."""
+    return " ".join(text.lower().split())
+
+
+def _header_key(text: str) -> str:
+    """Normalize block text for running header/footer detection; numbers such as page numbers are masked."""
+    return re.sub(r"\d+", "#", _normalize_block(text))
+
+
+def _build_text_elements(page_texts: List[List[str]]) -> List[Dict]:
+    """
+    Deduplicate text blocks across the document and merge each page's blocks into chunks.
+    
+    Blocks that repeat on most pages (running headers and footers, compared with
+    numbers masked) are dropped everywhere, and exact repeats within the document
+    are kept only once.
+    """
+    page_count = len(page_texts)
+    pages_with_block = Counter(
+        key for texts in page_texts for key in {_header_key(text) for text in texts}
+    )
+    
+    seen = set()
+    text_elements = []
     
+    for page_num, texts in enumerate(page_texts):
+        kept = []
+        for text in texts:
+            pages = pages_with_block[_header_key(text)]
+            key = _normalize_block(text)
+            if (pages >= 2 and pages * 2 > page_count) or key in seen:
+                continue
+            seen.add(key)
+            kept.append(text)
+        
+        for chunk_index, text in enumerate(_chunk_blocks(kept)):
+            text_elements.append({
+                "text": text,
+                "type": "Text",
+                "page": page_num + 1,
+                "element_id": f"text_p{page_num}_{chunk_index}"
+            })
+    
+    return text_elements
+
+
+def _process_page(pdf_document, page_num: int, images_dir: Optional[str], tables: bool, text: bool) -> Tuple[List, List, List]:
+    """
+    Run every requested extraction pass over a single page.
+    
+    Returns:
+        Tuple of (text_blocks, tables, images) for the page
+    """
+    page = pdf_document[page_num]
+    
+    # Build the TextPage once; its block listing (text plus image blocks) serves
+    # both the text and image passes
+    blocks = []
+    if text or images_dir:
+        textpage = page.get_textpage(flags=TEXTPAGE_FLAGS)
+        blocks = textpage.extractBLOCKS()
+        textpage = None
+    
+    # Detect tables once; the image pass needs their bboxes to skip ruled tables
+    tabs = page.find_tables().tables if tables or images_dir else []
+    table_rects = [fitz.Rect(tab.bbox) for tab in tabs]
+    
+    return (
+        _extract_page_text(blocks, page.rect.width) if text else [],
+        _extract_page_tables(tabs, page_num) if tables else [],
+        _extract_page_images(page, page_num, blocks, table_rects, Path(images_dir)) if images_dir else []
+    )
+
+
+def _process_page_range(pdf_path: str, start: int, stop: int, images_dir: Optional[str], tables: bool, text: bool) -> List[Tuple[List, List, List]]:
+    """
+    Worker: open the PDF once and process pages [start, stop) in a single pass.
+    
+    Runs in a separate process, since PyMuPDF documents cannot be shared across threads.
+    """
+    pdf_document = fitz.open(pdf_path)
+    results = [_process_page(pdf_document, page_num, images_dir, tables, text) for page_num in range(start, stop)]
     pdf_document.close()
-    print(f"    ✅ Extracted {image_count} images")
+    return results
+
+
+def _number_images(image_elements: List[Dict]) -> List[Dict]:
+    """Assign document-wide image ids in page order."""
+    for image_id, elem in enumerate(image_elements):
+        elem["element_id"] = f"image_{image_id}"
+    return image_elements
+
+
+def _number_tables(table_elements: List[Dict], tables_dir: Path) -> List[Dict]:
+    """Assign document-wide table ids in page order and save each table."""
+    for table_id, elem in enumerate(table_elements):
+        elem["element_id"] = f"table_{table_id}"
+        
+        # Save table
+        table_path = tables_dir / f"table_{table_id}.txt"
+        with open(table_path, 'w', encoding='utf-8') as f:
+            f.write(elem["text"])
+    return table_elements
+
+
+def _extract_pages(pdf_path: str, images_dir: Optional[Path] = None, tables_dir: Optional[Path] = None,
+                   text: bool = True, max_workers: Optional[int] = None) -> Dict[str, List]:
+    """
+    Fused extraction path: walk the PDF once, running the text, table, and image
+    passes on each page. Images are extracted only if images_dir is given and
+    tables only if tables_dir is given.
+    
+    Pages are split into contiguous shards of at least MIN_PAGES_PER_WORKER
+    pages and processed in parallel worker processes (PyMuPDF is not
+    thread-safe). Shorter documents, or max_workers=1, run in-process.
+    """
+    images_arg = str(images_dir) if images_dir else None
+    tables = tables_dir is not None
+    
+    pdf_document = fitz.open(pdf_path)
+    page_count = len(pdf_document)
+    
+    # Give each worker at least MIN_PAGES_PER_WORKER pages; below that, process
+    # startup (re-importing this module and re-parsing the PDF) outweighs the gain
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, page_count // MIN_PAGES_PER_WORKER))
+    
+    print(f"  ⚙️  Processing {page_count} pages with {max_workers} worker(s)...")
+    
+    if max_workers == 1:
+        page_results = [_process_page(pdf_document, page_num, images_arg, tables, text) for page_num in range(page_count)]
+        pdf_document.close()
+    else:
+        pdf_document.close()
+        shard_size = -(-page_count // max_workers)
+        starts = list(range(0, page_count, shard_size))
+        stops = [min(start + shard_size, page_count) for start in starts]
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            shard_results = executor.map(
+                _process_page_range,
+                [pdf_path] * len(starts),
+                starts,
+                stops,
+                [images_arg] * len(starts),
+                [tables] * len(starts),
+                [text] * len(starts)
+            )
+            page_results = [result for shard in shard_results for result in shard]
+    
+    # Flatten per-page results back into document order
+    page_texts, table_elements, image_elements = [], [], []
+    for page_text, page_tables, page_images in page_results:
+        page_texts.append(page_text)
+        table_elements.extend(page_tables)
+        image_elements.extend(page_images)
+    
+    return {
+        "text": _build_text_elements(page_texts) if text else [],
+        "tables": _number_tables(table_elements, tables_dir) if tables else [],
+        "images": _number_images(image_elements)
+    }
+
+
+def extract_images_with_pymupdf(pdf_path: str, output_dir: str = "data/extracted_images") -> List[Dict]:
+    """
+    Extract images from PDF using PyMuPDF.
+    """
+    images_dir = Path(output_dir)
+    images_dir.mkdir(parents=True, exist_ok=True)
+    
+    print(f"  🖼️  Extracting images with PyMuPDF...")
+    image_elements = _extract_pages(pdf_path, images_dir=images_dir, text=False)["images"]
+    print(f"    ✅ Extracted {len(image_elements)} images")
     return image_elements
 
 
@@ -66,38 +406,7 @@ def extract_tables_with_pymupdf(pdf_path: str, tables_dir: str) -> List[Dict]:
     tables_path = Path(tables_dir)
     tables_path.mkdir(parents=True, exist_ok=True)
     
-    pdf_document = fitz.open(pdf_path)
-    table_elements = []
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document[page_num]
-        
-        # Find tables using PyMuPDF
-        tabs = page.find_tables()
-        
-        for tab_index, tab in enumerate(tabs):
-            try:
-                # Extract table as pandas dataframe then convert to text
-                df = tab.to_pandas()
-                table_text = df.to_string(index=False)
-                
-                if table_text and len(table_text) > 20:
-                    table_id = len(table_elements)
-                    table_elements.append({
-                        "text": table_text,
-                        "html": df.to_html(index=False),
-                        "page": page_num + 1,
-                        "element_id": f"table_{table_id}"
-                    })
-                    
-                    # Save table
-                    table_path = tables_path / f"table_{table_id}.txt"
-                    with open(table_path, 'w', encoding='utf-8') as f:
-                        f.write(table_text)
-            except Exception as e:
-                print(f"    ⚠️  Error processing table on page {page_num+1}: {e}")
-    
-    pdf_document.close()
+    table_elements = _extract_pages(pdf_path, tables_dir=tables_path, text=False)["tables"]
     print(f"    ✅ Detected {len(table_elements)} tables")
     return table_elements
 
@@ -107,37 +416,15 @@ def extract_text_pymupdf(pdf_path: str) -> List[Dict]:
     Extract text using PyMuPDF.
     """
     print(f"  📄 Extracting text with PyMuPDF...")
-    
-    pdf_document = fitz.open(pdf_path)
-    text_elements = []
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document[page_num]
-        
-        # Extract text by blocks
-        blocks = page.get_text("blocks")
-        
-        for block in blocks:
-            if len(block) >= 5:
-                text = block[4].strip()
-                
-                # Only keep meaningful text blocks
-                if text and len(text) > 20:
-                    text_elements.append({
-                        "text": text,
-                        "type": "Text",
-                        "page": page_num + 1,
-                        "element_id": f"text_p{page_num}_{len([t for t in text_elements if t['page'] == page_num + 1])}"
-                    })
-    
-    pdf_document.close()
-    print(f"    ✅ Extracted {len(text_elements)} text blocks")
+    text_elements = _extract_pages(pdf_path)["text"]
+    print(f"    ✅ Extracted {len(text_elements)} text chunks")
     return text_elements
 
 
-def extract_elements(pdf_path: str, output_dir: str = "data") -> Dict[str, List]:
+def extract_elements(pdf_path: str, output_dir: str = "data", max_workers: Optional[int] = None) -> Dict[str, List]:
     """
-    Extract elements from PDF and separate into text, tables, and images.
+    Extract elements from PDF and separate into text, tables, and images
+    in a single pass over the document.
     """
     print(f"🔍 Extracting elements from {pdf_path}...")
     
@@ -147,21 +434,12 @@ def extract_elements(pdf_path: str, output_dir: str = "data") -> Dict[str, List]
     images_dir.mkdir(parents=True, exist_ok=True)
     tables_dir.mkdir(parents=True, exist_ok=True)
     
-    # Extract all element types
-    image_elements = extract_images_with_pymupdf(pdf_path, str(images_dir))
-    table_elements = extract_tables_with_pymupdf(pdf_path, str(tables_dir))
-    text_elements = extract_text_pymupdf(pdf_path)
-    
-    results = {
-        "text": text_elements,
-        "tables": table_elements,
-        "images": image_elements
-    }
+    results = _extract_pages(pdf_path, images_dir=images_dir, tables_dir=tables_dir, max_workers=max_workers)
     
     print(f"\n📊 Extraction Summary:")
-    print(f"  - Text elements: {len(text_elements)}")
-    print(f"  - Tables: {len(table_elements)}")
-    print(f"  - Images: {len(image_elements)}\n")
+    print(f"  - Text elements: {len(results['text'])}")
+    print(f"  - Tables: {len(results['tables'])}")
+    print(f"  - Images: {len(results['images'])}\n")
     
     return results
 
@@ -4,31 +4,53 @@ Generates summaries for text, tables, and images using Llama-8B and Gemini.
 """
 
 import os
-from typing import List, Dict
-from groq import Groq
+import asyncio
+import mimetypes
+from typing import Any, Awaitable, List, Dict, Optional
+import httpx
+from groq import AsyncGroq
 import google.generativeai as genai
 from dotenv import load_dotenv
 from PIL import Image
+from src.summary_cache import summary_key, get_summary, set_summary
+from src.async_utils import run_async, shared_http_client
 
 # Load environment variables
 load_dotenv()
 
-# Initialize API clients
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Initialize API clients; Groq clients are created per run (see _groq_client)
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+# Maximum number of concurrent Gemini Files API uploads
+UPLOAD_CONCURRENCY = 8
 
-def generate_text_summary(text: str, element_id: str = "") -> str:
+
+def _groq_client(http_client: httpx.AsyncClient) -> AsyncGroq:
+    """Create a Groq client on a run's shared connection pool (see shared_http_client)."""
+    return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client)
+
+
+async def generate_text_summary(text: str, element_id: str = "", client: Optional[AsyncGroq] = None) -> str:
     """
     Generate summary for text elements using Llama via Groq.
     
     Args:
         text: Text content to summarize
         element_id: Unique identifier for the element
+        client: Groq client to use; a pooled client is created for this call if omitted
         
     Returns:
         Generated summary
     """
+    if client is None:
+        async with shared_http_client() as http_client:
+            return await generate_text_summary(text, element_id, _groq_client(http_client))
+    
+    key = summary_key("text", text.encode("utf-8"))
+    cached = get_summary(key)
+    if cached is not None:
+        return cached
+    
     try:
         prompt = f"""Summarize the following text concisely while preserving key information and context:
 
@@ -36,7 +58,7 @@ Text: {text}
 
 Provide a clear, informative summary in 2-3 sentences."""
 
-        response = groq_client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that creates concise, accurate summaries."},
@@ -47,6 +69,7 @@ Provide a clear, informative summary in 2-3 sentences."""
         )
         
         summary = response.choices[0].message.content.strip()
+        set_summary(key, summary)
         return summary
     
     except Exception as e:
@@ -54,17 +77,27 @@ Provide a clear, informative summary in 2-3 sentences."""
         return text[:200]  # Fallback to truncated text
 
 
-def generate_table_summary(table_text: str, element_id: str = "") -> str:
+async def generate_table_summary(table_text: str, element_id: str = "", client: Optional[AsyncGroq] = None) -> str:
     """
     Generate summary for table elements using Llama via Groq.
     
     Args:
         table_text: Table content as text
         element_id: Unique identifier for the element
+        client: Groq client to use; a pooled client is created for this call if omitted
         
     Returns:
         Generated summary
     """
+    if client is None:
+        async with shared_http_client() as http_client:
+            return await generate_table_summary(table_text, element_id, _groq_client(http_client))
+    
+    key = summary_key("table", table_text.encode("utf-8"))
+    cached = get_summary(key)
+    if cached is not None:
+        return cached
+    
     try:
         prompt = f"""Analyze and summarize the following table, highlighting key data points and relationships:
 
@@ -73,7 +106,7 @@ Table:
 
 Provide a summary that captures the table's structure and main findings."""
 
-        response = groq_client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that analyzes tables and extracts key insights."},
@@ -84,6 +117,7 @@ Provide a summary that captures the table's structure and main findings."""
         )
         
         summary = response.choices[0].message.content.strip()
+        set_summary(key, summary)
         return summary
     
     except Exception as e:
@@ -91,29 +125,73 @@ Provide a summary that captures the table's structure and main findings."""
         return table_text[:200]  # Fallback to truncated text
 
 
-def generate_image_summary(image_path: str, element_id: str = "") -> str:
+def _image_key(image_path: str) -> str:
+    """Summary cache key for an image file."""
+    with open(image_path, 'rb') as f:
+        return summary_key("image", f.read())
+
+
+def _upload_image(image_path: str) -> Any:
+    """
+    Upload an image through the Gemini Files API.
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        Gemini file handle
+    """
+    mime_type = mimetypes.guess_type(image_path)[0] or "image/png"
+    return genai.upload_file(image_path, mime_type=mime_type)
+
+
+def _delete_upload(file_ref: Any) -> None:
+    """Delete an uploaded image from the Files API."""
+    try:
+        genai.delete_file(file_ref.name)
+    except Exception as e:
+        print(f"⚠️ Error deleting uploaded image {file_ref.name}: {e}")
+
+
+async def generate_image_summary(image_path: str, element_id: str = "",
+                                 upload_sem: Optional[asyncio.Semaphore] = None) -> str:
     """
     Generate summary for image elements using Gemini Flash (cost-effective).
     
+    The image is uploaded through the Files API, referenced in the request, and
+    deleted again once the summary is generated.
+    
     Args:
         image_path: Path to the image file
         element_id: Unique identifier for the element
+        upload_sem: Optional semaphore bounding concurrent uploads
         
     Returns:
         Generated summary
     """
+    file_ref = None
     try:
-        # Load image
-        img = Image.open(image_path)
+        key = _image_key(image_path)
+        cached = get_summary(key)
+        if cached is not None:
+            return cached
+        
+        # Reference the image through the Files API instead of sending it inline
+        if upload_sem is not None:
+            async with upload_sem:
+                file_ref = await asyncio.to_thread(_upload_image, image_path)
+        else:
+            file_ref = await asyncio.to_thread(_upload_image, image_path)
         
         # Use Gemini 2.5 Flash - latest stable version
         model = genai.GenerativeModel('gemini-2.5-flash')
         
         prompt = "Describe this image in detail. Focus on important visual elements, diagrams, charts, or any text present. Be specific and informative about what you see."
         
-        response = model.generate_content([prompt, img])
+        response = await model.generate_content_async([prompt, file_ref])
         
         summary = response.text.strip()
+        set_summary(key, summary)
         return summary
     
     except Exception as e:
@@ -127,61 +205,88 @@ def generate_image_summary(image_path: str, element_id: str = "") -> str:
             return fallback
         except:
             return f"Image at {image_path} (Description unavailable)"
+    
+    finally:
+        # Summaries are cached by content, so the upload is not needed afterwards
+        if file_ref is not None:
+            await asyncio.to_thread(_delete_upload, file_ref)
 
 
-def generate_summaries(elements: Dict[str, List]) -> Dict[str, List[Dict]]:
-    """
-    Generate summaries for all extracted elements.
+async def _bounded(sem: asyncio.Semaphore, coro: Awaitable[str]) -> str:
+    """Await a summary coroutine while holding the concurrency semaphore."""
+    async with sem:
+        return await coro
+
+
+async def _generate_summaries_async(elements: Dict[str, List], concurrency: int) -> Dict[str, List[Dict]]:
+    """Issue all summary requests concurrently, at most `concurrency` in flight."""
+    sem = asyncio.Semaphore(concurrency)
     
-    Args:
-        elements: Dictionary with 'text', 'tables', and 'images' lists
-        
-    Returns:
-        Dictionary with summarized elements including metadata
-    """
-    print("\n📝 Generating summaries...")
+    async with shared_http_client() as http_client:
+        return await _summarize_all(elements, sem, _groq_client(http_client))
+
+
+async def _summarize_all(elements: Dict[str, List], sem: asyncio.Semaphore, client: AsyncGroq) -> Dict[str, List[Dict]]:
+    """Summarize every element, with Groq requests sharing one client's connection pool."""
+    print(f"\n  Processing {len(elements['text'])} text elements...")
+    print(f"  Processing {len(elements['tables'])} table elements...")
+    print(f"  Processing {len(elements['images'])} image elements with Gemini...")
     
-    summarized_elements = {
-        "text": [],
-        "tables": [],
-        "images": []
-    }
+    # Image uploads happen inside each image task, overlapping the text and table requests
+    upload_sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
     
-    # Generate text summaries
-    print(f"\n  Processing {len(elements['text'])} text elements...")
-    for elem in elements['text']:
-        summary = generate_text_summary(elem['text'], elem['element_id'])
-        summarized_elements['text'].append({
+    text_tasks = [generate_text_summary(elem['text'], elem['element_id'], client) for elem in elements['text']]
+    table_tasks = [generate_table_summary(elem['text'], elem['element_id'], client) for elem in elements['tables']]
+    image_tasks = [generate_image_summary(elem['path'], elem['element_id'], upload_sem) for elem in elements['images']]
+    
+    # gather preserves task order, so results can be split back by position
+    summaries = await asyncio.gather(*[_bounded(sem, task) for task in text_tasks + table_tasks + image_tasks])
+    text_summaries = summaries[:len(text_tasks)]
+    table_summaries = summaries[len(text_tasks):len(text_tasks) + len(table_tasks)]
+    image_summaries = summaries[len(text_tasks) + len(table_tasks):]
+    
+    return {
+        "text": [{
             "summary": summary,
             "original_text": elem['text'],
             "element_id": elem['element_id'],
             "page": elem['page'],
             "element_type": "text"
-        })
-    
-    # Generate table summaries
-    print(f"  Processing {len(elements['tables'])} table elements...")
-    for elem in elements['tables']:
-        summary = generate_table_summary(elem['text'], elem['element_id'])
-        summarized_elements['tables'].append({
+        } for elem, summary in zip(elements['text'], text_summaries)],
+        "tables": [{
             "summary": summary,
             "original_text": elem['text'],
             "element_id": elem['element_id'],
             "page": elem['page'],
             "element_type": "table"
-        })
-    
-    # Generate image summaries
-    print(f"  Processing {len(elements['images'])} image elements with Gemini...")
-    for elem in elements['images']:
-        summary = generate_image_summary(elem['path'], elem['element_id'])
-        summarized_elements['images'].append({
+        } for elem, summary in zip(elements['tables'], table_summaries)],
+        "images": [{
             "summary": summary,
             "image_path": elem['path'],
             "element_id": elem['element_id'],
             "page": elem['page'],
             "element_type": "image"
-        })
+        } for elem, summary in zip(elements['images'], image_summaries)]
+    }
+
+
+def generate_summaries(elements: Dict[str, List], concurrency: int = 16) -> Dict[str, List[Dict]]:
+    """
+    Generate summaries for all extracted elements.
+    
+    Text, table, and image requests are sent concurrently rather than one
+    after another, bounded by a semaphore.
+    
+    Args:
+        elements: Dictionary with 'text', 'tables', and 'images' lists
+        concurrency: Maximum number of summary requests in flight
+        
+    Returns:
+        Dictionary with summarized elements including metadata
+    """
+    print("\n📝 Generating summaries...")
+    
+    summarized_elements = run_async(_generate_summaries_async(elements, concurrency))
     
     print("  ✅ All summaries generated!\n")
     return summarized_elements
@@ -190,5 +295,5 @@ def generate_summaries(elements: Dict[str, List]) -> Dict[str, List[Dict]]:
 if __name__ == "__main__":
     # Test summary generation
     test_text = "The Transformer architecture uses self-attention mechanisms to process sequences."
-    summary = generate_text_summary(test_text, "test_1")
+    summary = run_async(generate_text_summary(test_text, "test_1"))
     print(f"Test summary: {summary}")
@@ -4,16 +4,29 @@ Implements the complete RAG pipeline with Llama for generation and output parsin
 """
 
 import os
-from typing import List, Dict, Optional
-from groq import Groq
+import time
+import asyncio
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+import tiktoken
+from functools import lru_cache
+from groq import AsyncGroq, Groq
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 from src.vector_store import VectorStore
+from src.async_utils import run_async, shared_http_client
 
 # Load environment variables
 load_dotenv()
 
 
+# Tokenizer used to budget prompt context (an approximation of the Llama tokenizer)
+@lru_cache(maxsize=None)
+def _get_encoding() -> tiktoken.Encoding:
+    """Load the tokenizer on first use (tiktoken downloads the BPE file the first time)."""
+    return tiktoken.get_encoding("cl100k_base")
+
+
 class RAGResponse(BaseModel):
     """Structured output format for RAG responses."""
     answer: str = Field(description="The main answer to the user's question")
@@ -24,18 +37,31 @@ class RAGResponse(BaseModel):
 class RAGPipeline:
     """Complete RAG pipeline with retrieval and generation."""
     
-    def __init__(self, vector_store: VectorStore, model: str = "llama-3.1-8b-instant"):
+    def __init__(self, vector_store: VectorStore, model: str = "llama-3.1-8b-instant",
+                 cache_threshold: float = 0.95, cache_ttl: float = 3600.0,
+                 max_context_tokens: int = 2048, min_score: Optional[float] = 0.2):
         """
         Initialize RAG pipeline.
         
         Args:
             vector_store: VectorStore instance
             model: Groq model to use for generation
+            cache_threshold: Cosine similarity above which a previous answer is reused
+            cache_ttl: Seconds a cached answer stays valid
+            max_context_tokens: Token budget for retrieved context in the prompt
+            min_score: Minimum cosine similarity for a retrieved document to be used
         """
         self.vector_store = vector_store
         self.model = model
+        self.max_context_tokens = max_context_tokens
+        self.min_score = min_score
         self.groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
         
+        # Semantic cache of (query embedding, k, index generation, timestamp, response)
+        self.cache_threshold = cache_threshold
+        self.cache_ttl = cache_ttl
+        self._cache: List[Tuple[np.ndarray, int, int, float, RAGResponse]] = []
+        
         print(f"✅ RAG Pipeline initialized with model: {model}")
     
     def query(self, question: str, k: int = 5) -> RAGResponse:
@@ -51,29 +77,62 @@ class RAGPipeline:
         """
         print(f"\n🔍 Processing query: '{question}'")
         
+        # Step 0: Reuse the answer to a semantically identical earlier question
+        query_embedding = np.asarray(self.vector_store.embeddings.embed_query(question))
+        cached = self._cache_lookup(query_embedding, k)
+        if cached is not None:
+            print("  ⚡ Semantic cache hit, skipping generation\n")
+            return cached
+        
         # Step 1: Retrieve relevant documents
-        retrieved_docs = self.vector_store.query(question, k=k)
+        retrieved_docs = self.vector_store.query_by_vector(query_embedding.tolist(), k=k, score_threshold=self.min_score)
         
         if not retrieved_docs:
-            return RAGResponse(
-                answer="I couldn't find relevant information to answer this question.",
-                sources=[],
-                confidence="low"
-            )
+            return self._no_results_response()
         
         print(f"  📚 Retrieved {len(retrieved_docs)} relevant documents")
         
         # Step 2: Prepare context from retrieved documents
+        messages, sources = self._build_messages(question, retrieved_docs)
+        
+        # Step 3: Generate response using Llama
+        try:
+            response = self.groq_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=500
+            )
+            return self._finish_response(response, retrieved_docs, sources, query_embedding, k)
+        
+        except Exception as e:
+            return self._error_response(e, sources)
+    
+    def _build_messages(self, question: str, retrieved_docs: List) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Build the chat messages and source list for a question and its retrieved documents.
+        
+        Documents are taken in score order until the context token budget is spent;
+        the top document is truncated rather than dropped if it alone exceeds it.
+        """
         context_parts = []
         sources = []
+        budget = self.max_context_tokens
+        encoding = _get_encoding()
         
         for idx, doc in enumerate(retrieved_docs):
             element_type = doc.metadata.get('element_type', 'unknown')
             page = doc.metadata.get('page', 'N/A')
             
-            context_parts.append(
-                f"[Source {idx+1}] (Type: {element_type}, Page: {page})\n{doc.page_content}\n"
-            )
+            part = f"[Source {idx+1}] (Type: {element_type}, Page: {page})\n{doc.page_content}\n"
+            tokens = encoding.encode(part)
+            if len(tokens) > budget:
+                if context_parts:
+                    break
+                part = encoding.decode(tokens[:budget])
+            budget -= len(tokens)
+            
+            context_parts.append(part)
             
             sources.append({
                 "element_id": doc.metadata.get('element_id', f'doc_{idx}'),
@@ -84,7 +143,6 @@ class RAGPipeline:
         
         context = "\n".join(context_parts)
         
-        # Step 3: Generate response using Llama
         prompt = f"""You are a helpful AI assistant answering questions based on provided context from a document.
 
 Context:
@@ -100,37 +158,59 @@ Instructions:
 
 Answer:"""
         
-        try:
-            response = self.groq_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that answers questions based on provided context. Always cite your sources."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=500
-            )
-            
-            answer = response.choices[0].message.content.strip()
-            
-            # Determine confidence based on relevance
-            confidence = self._assess_confidence(answer, retrieved_docs)
-            
-            print(f"  ✅ Generated answer (Confidence: {confidence})\n")
-            
-            return RAGResponse(
-                answer=answer,
-                sources=sources,
-                confidence=confidence
-            )
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on provided context. Always cite your sources."},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, sources
+    
+    def _finish_response(self, response, retrieved_docs: List, sources: List[Dict],
+                         query_embedding: np.ndarray, k: int) -> RAGResponse:
+        """Turn a chat completion into a RAGResponse and add it to the semantic cache."""
+        answer = response.choices[0].message.content.strip()
         
-        except Exception as e:
-            print(f"  ❌ Error generating response: {e}\n")
-            return RAGResponse(
-                answer=f"Error generating response: {str(e)}",
-                sources=sources,
-                confidence="low"
-            )
+        # Determine confidence based on relevance
+        confidence = self._assess_confidence(answer, retrieved_docs)
+        
+        print(f"  ✅ Generated answer (Confidence: {confidence})\n")
+        
+        rag_response = RAGResponse(
+            answer=answer,
+            sources=sources,
+            confidence=confidence
+        )
+        self._cache.append((query_embedding, k, self.vector_store.generation, time.time(), rag_response))
+        return rag_response
+    
+    def _no_results_response(self) -> RAGResponse:
+        """Response used when retrieval finds nothing."""
+        return RAGResponse(
+            answer="I couldn't find relevant information to answer this question.",
+            sources=[],
+            confidence="low"
+        )
+    
+    def _error_response(self, error: Exception, sources: List[Dict]) -> RAGResponse:
+        """Response used when generation fails."""
+        print(f"  ❌ Error generating response: {error}\n")
+        return RAGResponse(
+            answer=f"Error generating response: {str(error)}",
+            sources=sources,
+            confidence="low"
+        )
+    
+    def _cache_lookup(self, query_embedding: np.ndarray, k: int) -> Optional[RAGResponse]:
+        """Return a cached response whose query is within the similarity threshold, if any."""
+        # Drop expired answers and answers built from an older version of the index
+        now = time.time()
+        generation = self.vector_store.generation
+        self._cache = [entry for entry in self._cache if entry[2] == generation and now - entry[3] < self.cache_ttl]
+        
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        for embedding, cached_k, _, _, response in self._cache:
+            if cached_k == k and float(np.dot(query_embedding, embedding)) >= self.cache_threshold:
+                return response
+        return None
     
     def _assess_confidence(self, answer: str, docs: List) -> str:
         """Assess confidence level based on answer and retrieved documents."""
@@ -142,22 +222,81 @@ Answer:"""
         else:
             return "low"
     
-    def batch_query(self, questions: List[str], k: int = 5) -> List[RAGResponse]:
+    def batch_query(self, questions: List[str], k: int = 5, concurrency: int = 8) -> List[RAGResponse]:
         """
         Process multiple queries.
         
+        All questions are embedded in one batch and searched with one
+        vectorized index lookup; answers are then generated concurrently.
+        
         Args:
             questions: List of questions
             k: Number of documents to retrieve per query
+            concurrency: Maximum number of generation requests in flight
             
         Returns:
             List of RAG responses
         """
-        responses = []
-        for question in questions:
-            response = self.query(question, k=k)
-            responses.append(response)
+        if not questions:
+            return []
+        
+        print(f"\n🔍 Processing {len(questions)} queries")
+        
+        # Step 0: Embed every question at once and answer cache hits directly
+        query_embeddings = np.asarray(self.vector_store.embeddings.embed_documents(questions))
+        responses: List[Optional[RAGResponse]] = [
+            self._cache_lookup(embedding, k) for embedding in query_embeddings
+        ]
+        pending = [idx for idx, response in enumerate(responses) if response is None]
+        
+        # Step 1: Retrieve documents for all remaining questions in one search
+        if pending:
+            docs_per_query = self.vector_store.batch_query_by_vector(
+                query_embeddings[pending].tolist(), k=k, score_threshold=self.min_score
+            )
+            
+            # Steps 2-3: Build contexts and generate answers concurrently
+            generated = run_async(self._generate_batch(
+                [questions[idx] for idx in pending],
+                docs_per_query,
+                [query_embeddings[idx] for idx in pending],
+                k,
+                concurrency
+            ))
+            for idx, response in zip(pending, generated):
+                responses[idx] = response
+        
         return responses
+    
+    async def _generate_batch(self, questions: List[str], docs_per_query: List[List], query_embeddings: List[np.ndarray],
+                              k: int, concurrency: int) -> List[RAGResponse]:
+        """Generate answers for several questions concurrently, at most `concurrency` in flight."""
+        sem = asyncio.Semaphore(concurrency)
+        
+        async with shared_http_client() as http_client:
+            client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client)
+            
+            async def generate(question: str, retrieved_docs: List, query_embedding: np.ndarray) -> RAGResponse:
+                if not retrieved_docs:
+                    return self._no_results_response()
+                
+                messages, sources = self._build_messages(question, retrieved_docs)
+                try:
+                    async with sem:
+                        response = await client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            temperature=0.3,
+                            max_tokens=500
+                        )
+                    return self._finish_response(response, retrieved_docs, sources, query_embedding, k)
+                except Exception as e:
+                    return self._error_response(e, sources)
+            
+            return await asyncio.gather(*[
+                generate(question, docs, embedding)
+                for question, docs, embedding in zip(questions, docs_per_query, query_embeddings)
+            ])
 
 
 def format_response(response: RAGResponse) -> str:
@@ -0,0 +1,46 @@
+"""
+Summary Cache Module
+Persists per-element summaries on disk, keyed by a hash of the element content,
+so unchanged text, tables, and images are never summarized twice.
+"""
+
+import hashlib
+from typing import Optional
+from diskcache import Cache
+
+# LRU-evicted on-disk cache shared by all summary generators
+summary_cache = Cache("data/cache/summaries", eviction_policy="least-recently-used")
+
+
+def summary_key(kind: str, content: bytes) -> str:
+    """
+    Build a cache key for an element.
+    
+    Args:
+        kind: Element kind ('text', 'table', 'image'); prompts differ per kind
+        content: Raw element content (text encoded as UTF-8, or image bytes)
+        
+    Returns:
+        Hex digest identifying the element
+    """
+    return hashlib.md5(kind.encode("utf-8") + b"\0" + content).hexdigest()
+
+
+def get_summary(key: str) -> Optional[str]:
+    """Return the cached summary for a key, or None."""
+    return summary_cache.get(key)
+
+
+def set_summary(key: str, summary: str) -> None:
+    """Store a summary under a key."""
+    summary_cache.set(key, summary)
+
+
+def clear_summaries() -> int:
+    """
+    Remove every cached summary so all elements are summarized again.
+    
+    Returns:
+        Number of summaries removed
+    """
+    return summary_cache.clear()
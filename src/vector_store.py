@@ -1,54 +1,150 @@
 """
 Vector Store Module
-Manages ChromaDB for storing and retrieving multimodal summaries.
+Manages a FAISS index for storing and retrieving multimodal summaries.
 """
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+import faiss
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 
+class SentenceTransformerEmbeddings(Embeddings):
+    """LangChain embeddings backed directly by a SentenceTransformer model, encoding in batches."""
+    
+    # Dynamically quantized int8 export published alongside the model on the HF hub
+    ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", device: Optional[str] = None,
+                 batch_size: int = 64, quantized: bool = False):
+        """
+        Initialize embeddings.
+        
+        Args:
+            model_name: SentenceTransformer model name
+            device: Device to run the model on (auto-detects CUDA when None)
+            batch_size: Number of texts encoded per forward pass
+            quantized: Run the int8 ONNX export on CPU via ONNX Runtime
+                (requires optimum[onnxruntime]); embeddings differ slightly
+                from the fp32 model, so keep this consistent per collection
+        """
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        if quantized:
+            self.model = SentenceTransformer(
+                model_name,
+                device="cpu",
+                backend="onnx",
+                model_kwargs={"file_name": self.ONNX_INT8_FILE}
+            )
+        else:
+            self.model = SentenceTransformer(model_name, device=device)
+            if device.startswith("cuda"):
+                # fp16 halves memory traffic and runs on tensor cores
+                self.model.half()
+        
+        self.batch_size = batch_size
+        
+        # The index uses inner product, which needs unit vectors. Models ending in a
+        # Normalize layer (all-MiniLM-L6-v2 does) already emit them, so skip the extra pass.
+        self.normalize = not isinstance(self.model[-1], Normalize)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts in a single batched encode call."""
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True
+        )
+        return embeddings.tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self.embed_documents([text])[0]
+
+
 class VectorStore:
-    """Manages vector storage and retrieval using ChromaDB."""
+    """Manages vector storage and retrieval using an exact FAISS inner-product index."""
     
-    def __init__(self, persist_directory: str = "data/chroma_db", collection_name: str = "multimodal_rag"):
+    def __init__(self, persist_directory: str = "data/faiss_index", collection_name: str = "multimodal_rag",
+                 device: Optional[str] = None, quantized: bool = False):
         """
         Initialize vector store.
         
         Args:
             persist_directory: Directory for persistent storage
-            collection_name: Name of the ChromaDB collection
+            collection_name: Name of the index (file stem inside persist_directory)
+            device: Embedding device (auto-detects CUDA when None)
+            quantized: Use the int8 ONNX embedding model on CPU
         """
         self.persist_directory = persist_directory
         self.collection_name = collection_name
         
-        # Initialize embeddings using HuggingFace (free, no API key needed)
+        # Initialize embeddings using SentenceTransformers (free, no API key needed)
         # Using a smaller, efficient model
-        self.embeddings = HuggingFaceEmbeddings(
+        self.embeddings = SentenceTransformerEmbeddings(
             model_name="all-MiniLM-L6-v2",  # Fast and efficient
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
+            device=device,
+            quantized=quantized
         )
         
-        # Initialize ChromaDB
-        self.vectorstore = Chroma(
-            collection_name=collection_name,
-            embedding_function=self.embeddings,
-            persist_directory=persist_directory
-        )
+        # Load the persisted FAISS index, or start an empty one. Embeddings are
+        # normalized, so inner product on a flat index is exact cosine search.
+        if (Path(persist_directory) / f"{collection_name}.faiss").exists():
+            self.vectorstore = FAISS.load_local(
+                persist_directory,
+                self.embeddings,
+                index_name=collection_name,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+                allow_dangerous_deserialization=True  # Pickled docstore written by save()
+            )
+        else:
+            dimension = self.embeddings.model.get_sentence_embedding_dimension()
+            self.vectorstore = FAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexFlatIP(dimension),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+        
+        # Bumped whenever the index contents change, so callers can invalidate derived caches
+        self.generation = 0
         
         print(f"✅ Vector store initialized: {collection_name}")
     
-    def add_summaries(self, summarized_elements: Dict[str, List[Dict]]) -> None:
+    def add_summaries(self, summarized_elements: Dict[str, List[Dict]], prune: bool = False) -> None:
         """
         Add summarized elements to the vector store.
         
+        Documents are keyed by a hash of their summary and metadata, so calling
+        this again with the same summaries is a no-op: only documents not already
+        in the index are embedded (in one batched encode call) and added, and the
+        index is saved to disk once. An element that moved (new page, id, or image
+        path) gets a new key and replaces its old entry.
+        
         Args:
             summarized_elements: Dictionary with 'text', 'tables', and 'images' summaries
+            prune: Also delete indexed documents that are not in summarized_elements,
+                so content removed from the PDF stops being retrieved. Only pass this
+                when summarized_elements is the complete corpus.
         """
         print("\n💾 Adding summaries to vector store...")
         
@@ -93,12 +189,43 @@ class VectorStore:
             )
             documents.append(doc)
         
+        # Key each document by a hash of its summary and metadata
+        current_documents = {}
+        for doc in documents:
+            key = json.dumps({"content": doc.page_content, "metadata": doc.metadata}, sort_keys=True)
+            current_documents[hashlib.md5(key.encode("utf-8")).hexdigest()] = doc
+        
+        existing_ids = set(self.vectorstore.index_to_docstore_id.values())
+        new_ids = [doc_id for doc_id in current_documents if doc_id not in existing_ids]
+        stale_ids = list(existing_ids - set(current_documents)) if prune else []
+        
+        if not new_ids and not stale_ids:
+            if documents:
+                print(f"  ⏭️  All {len(documents)} documents already indexed\n")
+            else:
+                print("  ⚠️ No documents to add\n")
+            return
+        
+        # Remove documents that no longer match any current element
+        if stale_ids:
+            self.vectorstore.delete(stale_ids)
+        
         # Add to vector store
-        if documents:
-            self.vectorstore.add_documents(documents)
-            print(f"  ✅ Added {len(documents)} documents to vector store\n")
-        else:
-            print("  ⚠️ No documents to add\n")
+        if new_ids:
+            texts = [current_documents[doc_id].page_content for doc_id in new_ids]
+            metadatas = [current_documents[doc_id].metadata for doc_id in new_ids]
+            embeddings = self.embeddings.embed_documents(texts)
+            
+            self.vectorstore.add_embeddings(
+                text_embeddings=list(zip(texts, embeddings)),
+                metadatas=metadatas,
+                ids=new_ids
+            )
+        
+        self.generation += 1
+        self.save()
+        print(f"  ✅ Added {len(new_ids)} and removed {len(stale_ids)} documents "
+              f"({len(current_documents) - len(new_ids)} already indexed)\n")
     
     def query(self, query_text: str, k: int = 5, filter_type: Optional[str] = None) -> List[Document]:
         """
@@ -120,6 +247,56 @@ class VectorStore:
         results = self.vectorstore.similarity_search(query_text, **search_kwargs)
         return results
     
+    def query_by_vector(self, embedding: List[float], k: int = 5, filter_type: Optional[str] = None,
+                        score_threshold: Optional[float] = None) -> List[Document]:
+        """
+        Query the vector store with a precomputed query embedding.
+        
+        Args:
+            embedding: Normalized query embedding
+            k: Number of results to return
+            filter_type: Optional filter by element type ('text', 'table', 'image')
+            score_threshold: Optional minimum cosine similarity for a result
+            
+        Returns:
+            List of relevant documents, highest scoring first
+        """
+        search_kwargs = {"k": k}
+        
+        if filter_type:
+            search_kwargs["filter"] = {"element_type": filter_type}
+        
+        results = self.vectorstore.similarity_search_with_score_by_vector(embedding, **search_kwargs)
+        return [doc for doc, score in results if score_threshold is None or score >= score_threshold]
+    
+    def batch_query_by_vector(self, embeddings: List[List[float]], k: int = 5,
+                              score_threshold: Optional[float] = None) -> List[List[Document]]:
+        """
+        Query the vector store for several precomputed embeddings in one index search.
+        
+        Args:
+            embeddings: Normalized query embeddings
+            k: Number of results to return per query
+            score_threshold: Optional minimum cosine similarity for a result
+            
+        Returns:
+            List of relevant documents for each query (highest scoring first), in input order
+        """
+        scores, indices = self.vectorstore.index.search(np.asarray(embeddings, dtype=np.float32), k)
+        
+        results = []
+        for row_scores, row in zip(scores, indices):
+            docs = []
+            for score, i in zip(row_scores, row):
+                # FAISS pads with -1 when the index holds fewer than k vectors
+                if i == -1 or (score_threshold is not None and score < score_threshold):
+                    continue
+                doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            results.append(docs)
+        return results
+    
     def as_retriever(self, k: int = 5):
         """
         Get retriever interface for RAG pipeline.
@@ -132,10 +309,14 @@ class VectorStore:
         """
         return self.vectorstore.as_retriever(search_kwargs={"k": k})
     
+    def save(self) -> None:
+        """Persist the index and docstore to disk."""
+        self.vectorstore.save_local(self.persist_directory, index_name=self.collection_name)
+    
     def get_collection_stats(self) -> Dict:
         """Get statistics about the collection."""
         try:
-            count = self.vectorstore._collection.count()
+            count = self.vectorstore.index.ntotal
             return {
                 "total_documents": count,
                 "collection_name": self.collection_name
@@ -0,0 +1,159 @@
+"""
+Unit tests for the pure text and layout helpers in src.extract_elements.
+"""
+
+import fitz
+import pytest
+
+from src import extract_elements as ee
+
+
+class CharEncoding:
+    """Stand-in for the tiktoken encoding: one token per character."""
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def char_encoding(monkeypatch):
+    monkeypatch.setattr(ee, "_get_encoding", lambda: CharEncoding())
+    monkeypatch.setattr(ee, "CHUNK_TOKENS", 10)
+    monkeypatch.setattr(ee, "CHUNK_OVERLAP", 3)
+
+
+def block(x0, y0, x1, y1, text):
+    return (x0, y0, x1, y1, text, 0, 0)
+
+
+# _chunk_blocks
+
+def test_chunk_blocks_merges_small_blocks():
+    assert ee._chunk_blocks(["abc", "de"]) == ["abc\nde"]
+
+
+def test_chunk_blocks_starts_next_chunk_with_overlap():
+    # "abcdef\n" (7) + "ghij\n" (5) exceeds 10 tokens; the second chunk repeats the last 3
+    assert ee._chunk_blocks(["abcdef", "ghij"]) == ["abcdef", "ef\nghij"]
+
+
+def test_chunk_blocks_splits_oversized_block_into_windows():
+    chunks = ee._chunk_blocks(["abcdefghijklmnop"])
+    assert chunks == ["abcdefghij", "hijklmnop"]
+    assert all(len(chunk) <= 10 for chunk in chunks)
+
+
+def test_chunk_blocks_does_not_emit_overlap_only_chunk():
+    # The tail left after the window split is all overlap, so no extra chunk follows
+    assert ee._chunk_blocks(["abcdefghijklm"]) == ["abcdefghij", "hijklm"]
+
+
+def test_chunk_blocks_empty():
+    assert ee._chunk_blocks([]) == []
+
+
+# _build_text_elements
+
+@pytest.fixture
+def wide_chunks(monkeypatch):
+    monkeypatch.setattr(ee, "CHUNK_TOKENS", 100)
+
+def test_build_text_elements_drops_running_headers_with_page_numbers(wide_chunks):
+    bodies = ["intro", "method", "results"]
+    pages = [[f"Journal of Tests, page {n}", body] for n, body in enumerate(bodies, 1)]
+    elements = ee._build_text_elements(pages)
+    assert [elem["text"] for elem in elements] == bodies
+    assert [elem["page"] for elem in elements] == [1, 2, 3]
+    assert elements[0]["element_id"] == "text_p0_0"
+
+
+def test_build_text_elements_keeps_blocks_differing_only_in_numbers(wide_chunks):
+    # Masked keys match, but the block is on too few pages to be a header
+    pages = [["Table 1", "Table 2"], ["x"], ["y"], ["z"]]
+    texts = [elem["text"] for elem in ee._build_text_elements(pages)]
+    assert texts == ["Table 1\nTable 2", "x", "y", "z"]
+
+
+def test_build_text_elements_header_threshold_needs_majority_of_pages(wide_chunks):
+    # On exactly half of the pages: kept once, then dropped as an exact repeat
+    pages = [["Running title"], ["Running title"], ["c"], ["d"]]
+    texts = [elem["text"] for elem in ee._build_text_elements(pages)]
+    assert texts == ["Running title", "c", "d"]
+    assert ee._build_text_elements([["Running title"]] * 3 + [["d"]])[0]["text"] == "d"
+
+
+def test_build_text_elements_single_page_keeps_everything(wide_chunks):
+    elements = ee._build_text_elements([["only"]])
+    assert [elem["text"] for elem in elements] == ["only"]
+
+
+def test_build_text_elements_drops_exact_repeats_ignoring_case_and_space(wide_chunks):
+    # On 2 of 5 pages, so not a header; the second copy is dropped
+    pages = [["Same  Text", "a"], ["same text", "b"], ["c"], ["d"], ["e"]]
+    texts = [elem["text"] for elem in ee._build_text_elements(pages)]
+    assert texts == ["Same  Text\na", "b", "c", "d", "e"]
+
+
+# _extract_page_text
+
+def test_extract_page_text_reads_columns_between_full_width_blocks():
+    width = 600
+    title = "A full-width paper title block"
+    blocks = [
+        block(320, 200, 560, 300, "right column, upper band text"),
+        block(40, 200, 280, 300, "left column, upper band text"),
+        block(40, 50, 560, 100, title),
+        block(40, 420, 280, 500, "left column, lower band text"),
+        block(40, 350, 560, 400, "full-width caption separating bands"),
+        block(320, 420, 560, 500, "right column, lower band text"),
+    ]
+    assert ee._extract_page_text(blocks, width) == [
+        title,
+        "left column, upper band text",
+        "right column, upper band text",
+        "full-width caption separating bands",
+        "left column, lower band text",
+        "right column, lower band text",
+    ]
+
+
+def test_extract_page_text_uses_block_midpoint_for_column():
+    # Starts left of the gutter edge but sits mostly in the right column
+    blocks = [
+        block(310, 100, 560, 150, "right column block, first line"),
+        block(40, 300, 290, 350, "left column block, lower on page"),
+    ]
+    assert ee._extract_page_text(blocks, 600) == [
+        "left column block, lower on page",
+        "right column block, first line",
+    ]
+
+
+def test_extract_page_text_skips_short_and_image_blocks():
+    blocks = [block(40, 10, 280, 20, "short"), (40, 30, 280, 40, "<image>", 1, 1)]
+    assert ee._extract_page_text(blocks, 600) == []
+
+
+# _merge_rects
+
+def test_merge_rects_joins_overlapping_and_nearby_parts():
+    merged = ee._merge_rects([(0, 0, 10, 10), (5, 5, 20, 20), (23, 0, 30, 10)])
+    assert merged == [fitz.Rect(0, 0, 30, 20)]
+
+
+def test_merge_rects_keeps_distant_parts_apart_in_reading_order():
+    merged = ee._merge_rects([(100, 100, 120, 120), (0, 100, 10, 110), (0, 0, 10, 10)])
+    assert merged == [fitz.Rect(0, 0, 10, 10), fitz.Rect(0, 100, 10, 110), fitz.Rect(100, 100, 120, 120)]
+
+
+def test_merge_rects_merges_transitively():
+    # a and c are only connected through b
+    merged = ee._merge_rects([(0, 0, 10, 10), (40, 0, 50, 10), (12, 0, 38, 10)])
+    assert merged == [fitz.Rect(0, 0, 50, 10)]
+
+
+def test_merge_rects_empty():
+    assert ee._merge_rects([]) == []